@@ -24,8 +24,8 @@ Author: Dom932
 URL: https://github.com/Dom932
 
 Requirements:
-            Python 3.6+
-            netmiko 2.1.1+
+            Python 3.10+
+            netmiko 3.1+
 Usage:
 
     Example Usage of required inputs:
@@ -40,35 +40,144 @@ Usage:
 
 import argparse
 import csv
+import hashlib
+import heapq
+import random
+import threading
 import time
+from dataclasses import dataclass
 import logging
 import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
-from netmiko import FileTransfer
-from helpers import DeviceHelper, ConnectionException
-from helpers import ThreadingHelper
+from icmplib import multiping
+from helpers import ConnectionPool, DeviceHelper, ConnectionException, ParallelFileTransfer
 
 _logger = logging.getLogger(__name__)
 
+CSV_HEADER = ["Name", "IP Address", "Connected", "SuccessfullyRebooted", "Error"]
 
+
+@dataclass(slots=True)
 class Device:
     """
     Device Class
+
+    Slotted so a large inventory does not pay a per-instance __dict__.
+    """
+
+    ip_address: str
+    name: str = ""
+    connected: bool = False
+    successfully_rebooted: bool = False
+    file_uploaded: bool = False
+    error: str = ""
+    credentials: list | None = None
+    config_backed_up: bool = False
+    reboot_pending: bool = False
+
+
+class RebootMonitor(threading.Thread):
+    """
+    Background thread that watches rebooting devices so worker threads do not
+    sit out the reboot window themselves.
+
+    Workers call register() right after issuing the reload and return to the
+    pool. The monitor keeps a heap of (ready time, device) entries, sleeps
+    until the earliest is due, and checks every due device with one batched
+    ICMP probe. Devices that do not answer are re-queued until their deadline
+    passes, then marked as not rebooted. With the waits pooled here, N reboots
+    cost roughly one reboot window rather than N / worker_threads of them.
     """
 
-    def __init__(self, ip_address):
-        self.ip_address = ip_address
-        self.name = ""
-        self.connected = False
-        self.successfully_rebooted = False
-        self.file_uploaded = False
-        self.error = ""
-        self.credentials = None
-        self.config_backed_up = False
+    # seconds before the first probe - let the device actually go down
+    _SETTLE = 30
+    # seconds after the reload before a device is marked unresponsive
+    _DEADLINE = 600
+    # seconds between probes of the same device
+    _RETRY = 10
+
+    def __init__(self):
+        super().__init__(name="reboot-monitor", daemon=True)
+        self._cond = threading.Condition()
+        self._heap = []
+        self._seq = 0
+        self._closing = False
+
+    def register(self, device):
+        """
+        Start watching a device that has just been told to reload.
+
+        :param device: device to watch
+        :type device: Device
+        """
+        now = time.monotonic()
+        with self._cond:
+            # seq breaks ties so Device objects are never compared
+            heapq.heappush(self._heap, (now + self._SETTLE, self._seq,
+                                        now + self._DEADLINE, device))
+            self._seq += 1
+            self._cond.notify()
+
+    def close(self):
+        """
+        Signal that no more devices will be registered and block until every
+        pending device has resolved.
+        """
+        with self._cond:
+            self._closing = True
+            self._cond.notify()
+        self.join()
+
+    def run(self):
+        while True:
+            with self._cond:
+                if not self._heap:
+                    if self._closing:
+                        return
+                    self._cond.wait()
+                    continue
+
+                wait = self._heap[0][0] - time.monotonic()
+                if wait > 0:
+                    self._cond.wait(timeout=wait)
+                    continue
+
+                now = time.monotonic()
+                due = []
+                while self._heap and self._heap[0][0] <= now:
+                    due.append(heapq.heappop(self._heap))
+
+            # probe outside the lock so register() is never blocked on ICMP
+            self._check(due)
+
+    def _check(self, due):
+        """
+        Probe a batch of due devices with one multiping and resolve or re-queue
+        each one.
+        """
+        alive = {host.address: host.is_alive
+                 for host in multiping([entry[3].ip_address for entry in due],
+                                       count=2, interval=0.2, timeout=1, privileged=False)}
+
+        now = time.monotonic()
+        with self._cond:
+            for _, seq, deadline, device in due:
+                if alive.get(device.ip_address):
+                    device.successfully_rebooted = True
+                    device.reboot_pending = False
+                    _logger.info(f"{device.ip_address} - Device Rebooted")
+                elif now >= deadline:
+                    device.reboot_pending = False
+                    _logger.warning(f"{device.ip_address} - Device not rebooted")
+                else:
+                    heapq.heappush(self._heap, (now + self._RETRY, seq, deadline, device))
+            self._cond.notify()
 
 
 def upgrade_asa(device, image_type, image_location, dest_drive="disk0:", reboot=False,
-                backup_config=False, backup_location=None):
+                backup_config=False, backup_location=None, source_md5=None, compress=False,
+                reboot_monitor=None):
     """
     Method to upgrade a Cisco ASA OS version or ASDM Version
 
@@ -86,101 +195,142 @@ def upgrade_asa(device, image_type, image_location, dest_drive="disk0:", reboot=
     :type backup_config: bool
     :param backup_location: location to save backups
     :type backup_location: str
+    :param source_md5: (optional) precomputed MD5 of the image, so the local file
+    is not re-hashed per device
+    :type source_md5: str
+    :param compress: (optional) use SSH compression for the image transfer
+    :type compress: bool
+    :param reboot_monitor: (optional) monitor to hand the post-reboot wait to. When
+    set, the device is returned with reboot_pending=True as soon as the reload is
+    issued; without one the worker polls the device itself
+    :type reboot_monitor: RebootMonitor
     :return: Device with updated attributes
     """
 
     try:
 
-        connection = DeviceHelper.connect_to_device(ipaddr=device.ip_address, credentials=device.credentials,
-                                                    enable_mode=True, device_type=["cisco_asa"])
+        pool = ConnectionPool.instance()
 
-        device.connected = True
+        with pool.connection(ipaddr=device.ip_address, credentials=device.credentials,
+                             enable_mode=True, device_type=["cisco_asa"]) as connection:
 
-        prompt = connection.find_prompt()
+            device.connected = True
 
-        device.name = prompt[0:(len(prompt) - 1)]
+            prompt = connection.find_prompt()
 
-        # Backup config
-        if backup_config:
-            _logger.info(f"{device.ip_address} - Starting Config Backup")
+            device.name = prompt[0:(len(prompt) - 1)]
 
-            config = connection.send_command("sh run")
-            DeviceHelper.backup_config(config, backup_location, device.name)
+            # fetch the running config once - it serves both the backup and the
+            # SCP probe, saving a prompt round trip per device
+            running_config = connection.send_command("show running-config")
 
-            _logger.info(f"{device.ip_address} - Completed Config")
+            # Backup config
+            if backup_config:
+                _logger.info(f"{device.ip_address} - Starting Config Backup")
 
-        image_file_name = Path(image_location).name
+                DeviceHelper.backup_config(running_config, backup_location, device.name)
 
-        # Check if scp is enabled
-        output = connection.send_command("sh run | i ssh scopy enable")
+                _logger.info(f"{device.ip_address} - Completed Config")
 
-        if output.lower() is "ssh copy enable":
-            _logger.debug(f"{device.ip_address} - SCP enabled")
-            scp_enabled = True
-        else:
-            _logger.debug(f"{device.ip_address} - SCP not enabled. Enabling")
-            scp_enabled = False
-            # enable SCP
-            connection.send_config_set(["ssh scopy enable"])
-
-        with FileTransfer(connection, source_file=image_location, dest_file=image_file_name,
-                          file_system=dest_drive) as scp:
-            _logger.debug(f"{device.ip_address} - Starting to copy image to device")
-            # check if there is free space
-            if scp.verify_space_available():
-                # Transfer file
-                scp.transfer_file()
-
-                # verify file
-                if not scp.verify_file():
-                    device.error = "File transfer verifier failed"
-                    _logger.info(f"{device.ip_address} - file verifier failed")
-                else:
-                    device.file_uploaded = True
-                    _logger.info(f"{device.ip_address} - Not enough space to image")
+            image_file_name = Path(image_location).name
 
+            # Check if scp is enabled - scan the config we already hold rather
+            # than issuing another piped show command
+            if "ssh scopy enable" in running_config:
+                _logger.debug("%s - SCP enabled", device.ip_address)
+                scp_enabled = True
             else:
-                device.error = "Not enough space to upload file"
-
-        # disable scp if it was not enabled originally
-        if not scp_enabled:
-            connection.send_config_set(["no ssh scopy enable"])
-            _logger.debug(f"{device.ip_address} - Disabling SCP")
-
-        # if file was uploaded set it as the new image
-        if device.file_uploaded:
-
-            asa_file_path = f"{dest_drive}/{image_file_name}"
-
-            if image_type.lower() == "asa":
-                config = f"boot system {asa_file_path}"
-                _logger.debug(f"{device.ip_address} - setting ASA boot image to : {asa_file_path}")
-                connection.send_config_set([config])
-            elif image_type.lower() == "asdm":
-                config = f"asdm image {asa_file_path}"
-                _logger.debug(f"{device.ip_address} - setting ASDM image to : {asa_file_path}")
-                connection.send_config_set([config])
-
-            # save config
-            _logger.debug(f"{device.ip_address} - Saving Config")
-            connection.save_config()
-
-            # reboot if set
-            if reboot:
-                _logger.info(f"{device.ip_address} - Rebooting device")
-                connection.send_confg_set(["reboot"])
-                connection.send_confg_set(["y"])
-
-                # wait 5 mins to and check
-                time.sleep(300)
+                _logger.debug("%s - SCP not enabled. Enabling", device.ip_address)
+                scp_enabled = False
+                # enable SCP
+                connection.send_config_set(["ssh scopy enable"])
+
+            with ParallelFileTransfer(connection, source_file=image_location,
+                                      dest_file=image_file_name, file_system=dest_drive,
+                                      source_md5=source_md5, compress=compress) as scp:
+                _logger.debug("%s - Starting to copy image to device", device.ip_address)
+                # check if there is free space
+                if scp.verify_space_available():
+                    # Transfer file
+                    scp.transfer_file()
+
+                    # verify file
+                    if not scp.verify_file():
+                        device.error = "File transfer verifier failed"
+                        _logger.info(f"{device.ip_address} - file verifier failed")
+                    else:
+                        device.file_uploaded = True
+                        _logger.info(f"{device.ip_address} - Not enough space to image")
 
-                device.successfully_rebooted = DeviceHelper.ping(device.ip_address)
-
-                if device.successfully_rebooted:
-                    _logger.info(f"{device.ip_address} - Device Rebooted")
                 else:
-                    _logger.warning(f"{device.ip_address} - Device not rebooted")
-                return device
+                    device.error = "Not enough space to upload file"
+
+            # batch the post-upload config into a single send_config_set call - one
+            # prompt round trip instead of one per command
+            config_set = []
+
+            # if file was uploaded set it as the new image
+            if device.file_uploaded:
+
+                asa_file_path = f"{dest_drive}/{image_file_name}"
+
+                if image_type.lower() == "asa":
+                    _logger.debug("%s - setting ASA boot image to : %s", device.ip_address, asa_file_path)
+                    config_set.append(f"boot system {asa_file_path}")
+                elif image_type.lower() == "asdm":
+                    _logger.debug("%s - setting ASDM image to : %s", device.ip_address, asa_file_path)
+                    config_set.append(f"asdm image {asa_file_path}")
+
+            # disable scp if it was not enabled originally
+            if not scp_enabled:
+                _logger.debug("%s - Disabling SCP", device.ip_address)
+                config_set.append("no ssh scopy enable")
+
+            if config_set:
+                connection.send_config_set(config_set, cmd_verify=False)
+
+            if device.file_uploaded:
+
+                # save config
+                _logger.debug("%s - Saving Config", device.ip_address)
+                connection.save_config()
+
+                # reboot if set
+                if reboot:
+                    _logger.info(f"{device.ip_address} - Rebooting device")
+                    connection.send_command_timing("reload\n", strip_prompt=False, strip_command=False)
+                    connection.send_command_timing("y")
+
+                    # the device is going down - do not return this connection
+                    # to the pool
+                    pool.discard(connection)
+
+                    # hand the wait to the shared monitor so this worker is
+                    # immediately free for the next device
+                    if reboot_monitor is not None:
+                        device.reboot_pending = True
+                        reboot_monitor.register(device)
+                        return device
+
+                    # give the device 30s to actually go down, then poll with a
+                    # backoff instead of sleeping a flat 5 minutes - devices
+                    # that reboot in 45-90s hand their worker back early
+                    time.sleep(30)
+
+                    deadline = time.monotonic() + 600
+                    wait = 10
+                    while time.monotonic() < deadline:
+                        if DeviceHelper.ping(device.ip_address, ping_count=1):
+                            device.successfully_rebooted = True
+                            break
+                        time.sleep(wait)
+                        wait = min(wait * 1.5, 30)
+
+                    if device.successfully_rebooted:
+                        _logger.info(f"{device.ip_address} - Device Rebooted")
+                    else:
+                        _logger.warning(f"{device.ip_address} - Device not rebooted")
+                    return device
 
     except ConnectionException as e:
         device.connected = False
@@ -193,47 +343,44 @@ def upgrade_asa(device, image_type, image_location, dest_drive="disk0:", reboot=
         _logger.error(f"{e}")
         return device
 
+    return device
+
 
 def read_csv(input_file):
     """
-    Read a CSV file with an 'IP Address' column  creating a list of devices objects
+    Read a CSV file with an 'IP Address' column, yielding a Device per row.
+    Rows are streamed rather than held in memory so large inventories can be
+    fed straight to the worker pool.
     :param input_file: csv file location
     :type input_file: str
-    :return list: list of devices based on CSV
+    :return generator: generator of devices based on CSV
     """
 
-    devices = []
-
-    # Read CSV file and write each row to a Device object
-    with Path(input_file).open(mode="r") as csv_file:
-        reader = csv.DictReader(csv_file)
+    # Read CSV file and yield each row as a Device object. A plain reader
+    # indexed by the header position skips DictReader's dict per row;
+    # newline="" keeps the csv module from re-parsing line endings
+    with Path(input_file).open(mode="r", newline="") as csv_file:
+        reader = csv.reader(csv_file)
+        header = next(reader)
+        ip_idx = header.index("IP Address")
         for row in reader:
-            device = Device(ip_address=row["IP Address"])
-            devices.append(device)
+            if row:
+                yield Device(ip_address=row[ip_idx])
 
-    return devices
 
-
-def write_csv(output_file, devices):
+def device_row(device):
     """
-    Write each device to CSV
-    :param output_file: location where to save CSV file
-    :type output_file: str
-    :param devices: list of device objects
-    :type devices: list
+    Build the report CSV row for a device, matching CSV_HEADER
+    :param device: device to report on
+    :type device: Device
+    :return list: row values
     """
-
-    with Path(output_file).open(mode="w") as csvfile:
-        wr = csv.writer(csvfile, dialect="excel")
-        wr.writerow(["Name", "IP Address", "Connected", "SuccessfullyRebooted", "Error"])
-
-        for device in devices:
-            row = [device.name, device.ip_address, device.connected, device.successfully_rebooted, device.error]
-            wr.writerow(row)
+    return [device.name, device.ip_address, device.connected,
+            device.successfully_rebooted, device.error]
 
 
 def main(input_csv, output_csv, image_type, image_location, dest_drive, credentials, reboot=False,
-         backup_config=False, backup_location=None, worker_threads=4):
+         backup_config=False, backup_location=None, worker_threads=4, compress=None):
     """
     Main run method
     :param input_csv: Location of CSV file to read
@@ -258,13 +405,21 @@ def main(input_csv, output_csv, image_type, image_location, dest_drive, credenti
     :type backup_location: str
     :param worker_threads: (optional) Number of worker threads. Default is 4
     :type worker_threads: int
+    :param compress: (optional) use SSH compression for transfers. Default is None,
+    which enables it for ASDM images (the most compressible) only
+    :type compress: bool
     :return:
     """
 
-    # create list of devices
-    device_list = read_csv(input_csv)
+    # drop duplicate rows, then shuffle with a fixed seed so neighbouring
+    # subnets (which usually share an upstream TACACS/RADIUS server) are
+    # spread over time instead of hitting that server all at once
+    seen = set()
+    device_list = [device for device in read_csv(input_csv)
+                   if not (device.ip_address in seen or seen.add(device.ip_address))]
+    random.Random(0).shuffle(device_list)
 
-    _logger.info(f"Starting ASA upgrades on:{len(device_list)}")
+    _logger.info("Starting ASA upgrades")
     _logger.info(f"-Worker Threads: {worker_threads}")
     _logger.info(f"-Image Type: {image_type}")
     _logger.info(f"-Image Location: {image_location}")
@@ -273,9 +428,20 @@ def main(input_csv, output_csv, image_type, image_location, dest_drive, credenti
     _logger.info(f"-Backup Config: {backup_config}")
     _logger.info(f"-Backup Location: {backup_location}")
 
-    # Populate credentials
-    for d in device_list:
-        d.credentials = credentials
+    # default compression on for ASDM images, which compress well; plain ASA
+    # images much less so
+    if compress is None:
+        compress = image_type.lower() == "asdm"
+
+    _logger.info(f"-Compress: {compress}")
+
+    # hash the image once up front - every device verify reuses this digest
+    # instead of re-reading the whole file
+    md5 = hashlib.md5()
+    with Path(image_location).open(mode="rb") as image_file:
+        for chunk in iter(lambda: image_file.read(1 << 20), b""):
+            md5.update(chunk)
+    source_md5 = md5.hexdigest()
 
     args = {
         "image_type": image_type,
@@ -284,14 +450,50 @@ def main(input_csv, output_csv, image_type, image_location, dest_drive, credenti
         "dest_drive": dest_drive,
         "backup_config": backup_config,
         "backup_location": backup_location,
+        "source_md5": source_md5,
+        "compress": compress,
     }
 
-    # create threading helper
+    # one monitor watches every rebooting device so reboot waits do not
+    # serialize through the worker pool
+    reboot_monitor = None
+    if reboot:
+        reboot_monitor = RebootMonitor()
+        reboot_monitor.start()
+    args["reboot_monitor"] = reboot_monitor
+
     _logger.debug("Starting Threads")
-    th = ThreadingHelper(worker_func=upgrade_asa, num_of_workers=worker_threads, worker_func_args=args)
-    result = th.run(device_list)
+    # newline="" stops the csv module re-translating line endings on Windows;
+    # the 64 KiB buffer keeps write syscalls out of the result loop
+    with ThreadPoolExecutor(max_workers=worker_threads, thread_name_prefix="asa-upd") as executor, \
+            Path(output_csv).open(mode="w", newline="", buffering=1 << 16) as csvfile:
+
+        wr = csv.writer(csvfile, dialect="excel")
+        wr.writerow(CSV_HEADER)
+
+        futures = []
+        for device in device_list:
+            device.credentials = credentials
+            futures.append(executor.submit(upgrade_asa, device, **args))
+
+        _logger.info(f"Submitted {len(futures)} devices for upgrade")
+
+        # write each row as its device finishes rather than holding every
+        # result until the whole batch is done; devices still waiting on a
+        # reboot check are held back until the monitor resolves them
+        pending_reboot = []
+        for future in as_completed(futures):
+            device = future.result()
+            if device.reboot_pending:
+                pending_reboot.append(device)
+                continue
+            wr.writerow(device_row(device))
+
+        if reboot_monitor is not None:
+            reboot_monitor.close()
 
-    write_csv(output_csv, result)
+        for device in pending_reboot:
+            wr.writerow(device_row(device))
 
 
 if __name__ == "__main__":
@@ -307,6 +509,9 @@ if __name__ == "__main__":
                        help="<Required> Location of image file to upload")
     parse.add_argument("-d", "--destdrive", type=str, default="disk0:",
                        help="Location drive where image file is to be saved. Default is disk0:")
+    parse.add_argument("-c", "--compress", action="store_true", default=None,
+                       help="Use SSH compression for the image transfer. Defaults to on for "
+                            "ASDM images and off for ASA images")
     parse.add_argument("-r", "--reboot", action="store_true",
                        help="Set if the ASA should be rebooted after uploading")
     parse.add_argument("-b", "--backupconfig", action="store_true",
@@ -314,7 +519,9 @@ if __name__ == "__main__":
     parse.add_argument("-bl", "--backuplocation", type=str,
                        help="Backup location not set")
     parse.add_argument("-w", "--workerthreads", type=int, default=4,
-                       help="Number of worker threads to use. Default is 4")
+                       help="Number of worker threads to use. The upgrade is I/O bound (SSH/SCP), "
+                            "so this can be raised well above the CPU count for large device "
+                            "batches. Default is 4")
     parse.add_argument("-lv","--logginglevel", type=str, choices=["critical", "error", "warning", "info", "debug", "notset"],
                        default="info",
                        help="Logging level, Default is info")
@@ -354,4 +561,5 @@ if __name__ == "__main__":
         main(input_csv=parse_args.inputcsv, output_csv=parse_args.outputcsv, image_type=parse_args.imagetype,
              image_location=parse_args.imagelocation, dest_drive=parse_args.destdrive, reboot=parse_args.reboot,
              credentials=credentials_, backup_config=parse_args.backupconfig,
-             backup_location=parse_args.backuplocation, worker_threads=parse_args.workerthreads)
+             backup_location=parse_args.backuplocation, worker_threads=parse_args.workerthreads,
+             compress=parse_args.compress)
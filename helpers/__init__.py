@@ -1,2 +1,4 @@
 from helpers.threading_helper import ThreadingHelper
 from helpers.device_helper import DeviceHelper, ConnectionException
+from helpers.connection_pool import ConnectionPool
+from helpers.scp_helper import ParallelFileTransfer
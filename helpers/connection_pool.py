@@ -0,0 +1,217 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from helpers.device_helper import DeviceHelper
+
+
+class ConnectionPool:
+    """
+    Pool of netmiko connections keyed by (ip address, username, device type).
+
+    Opening an SSH session costs a TCP + SSH handshake and authentication
+    (typically 1-3 seconds) and ASAs limit the number of concurrent sessions,
+    so connections are kept open between operations and handed back out on the
+    next acquire for the same device and credentials.
+
+    Pooled connections are validated before reuse and are evicted once they
+    have been idle for idle_timeout seconds, once they are max_age seconds old,
+    or when an error occurs while they are in use.
+
+    Example:
+
+        pool = ConnectionPool.instance()
+
+        with pool.connection(ipaddr="192.168.0.1", credentials=cred,
+                             enable_mode=True, device_type=["cisco_asa"]) as conn:
+            conn.send_command("sh ver")
+    """
+
+    _logger = logging.getLogger(__name__)
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self, idle_timeout=300, max_age=3600, max_size=100):
+        """
+        :param idle_timeout: seconds an unused connection may sit in the pool before
+                             it is closed. Default is 300
+        :type idle_timeout: int
+        :param max_age: seconds after which a connection is closed regardless of use.
+                        Default is 3600
+        :type max_age: int
+        :param max_size: maximum number of connections to keep pooled. Default is 100
+        :type max_size: int
+        """
+        self.idle_timeout = idle_timeout
+        self.max_age = max_age
+        self.max_size = max_size
+        self._lock = threading.RLock()
+        self._pool = {}
+
+    @classmethod
+    def instance(cls):
+        """
+        Return the shared ConnectionPool, creating it on first use.
+
+        :return: ConnectionPool
+        """
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls()
+            return cls._instance
+
+    @contextmanager
+    def connection(self, ipaddr, credentials, enable_mode=False, device_type="autodetect",
+                   timeout=None):
+        """
+        Context manager yielding a connection to a device, reusing a pooled one
+        where possible. The connection is returned to the pool on exit, or closed
+        and evicted if the block raised (its state is then unknown).
+
+        Parameters match DeviceHelper.connect_to_device.
+
+        :Raises ConnectionException: If unable to connect to device
+        """
+        conn = self.acquire(ipaddr=ipaddr, credentials=credentials, enable_mode=enable_mode,
+                            device_type=device_type, timeout=timeout)
+        try:
+            yield conn
+        except Exception:
+            self.discard(conn)
+            raise
+        else:
+            self.release(conn)
+
+    def acquire(self, ipaddr, credentials, enable_mode=False, device_type="autodetect",
+                timeout=None):
+        """
+        Get a connection to a device, reusing a pooled one where possible.
+
+        Parameters match DeviceHelper.connect_to_device.
+
+        :return: netmiko.ConnectHandler
+
+        :Raises ConnectionException: If unable to connect to device
+        """
+
+        if isinstance(credentials, dict):
+            credentials = [credentials]
+
+        usernames = {c["username"] for c in credentials if "username" in c}
+
+        while True:
+
+            candidate = None
+
+            with self._lock:
+                self._evict_stale()
+
+                for key, entry in self._pool.items():
+                    if key[0] == ipaddr and key[1] in usernames and not entry["in_use"]:
+                        # claim it now; the liveness probe is network I/O that
+                        # can block for a full read timeout, so it happens
+                        # outside the lock
+                        entry["in_use"] = True
+                        entry["last_used"] = time.monotonic()
+                        candidate = entry["conn"]
+                        break
+
+            if candidate is None:
+                break
+
+            # make sure the claimed connection is still usable
+            try:
+                candidate.find_prompt()
+            except Exception:
+                self._logger.debug("%s - Pooled connection dead. Evicting", ipaddr)
+                self.discard(candidate)
+                continue
+
+            self._logger.debug("%s - Reusing pooled connection", ipaddr)
+            return candidate
+
+        # no reusable connection - establish a new one outside the lock so slow
+        # handshakes do not block other workers
+        conn = DeviceHelper.connect_to_device(ipaddr=ipaddr, credentials=credentials,
+                                              enable_mode=enable_mode, device_type=device_type,
+                                              timeout=timeout)
+
+        key = (ipaddr, conn.username, conn.device_type)
+        now = time.monotonic()
+
+        with self._lock:
+            if key not in self._pool and len(self._pool) < self.max_size:
+                self._pool[key] = {"conn": conn, "in_use": True, "created": now, "last_used": now}
+
+        return conn
+
+    def release(self, conn):
+        """
+        Return a connection to the pool so it can be reused.
+
+        :param conn: connection previously returned by acquire()
+        :type conn: netmiko.ConnectHandler
+        """
+        with self._lock:
+            for entry in self._pool.values():
+                if entry["conn"] is conn:
+                    entry["in_use"] = False
+                    entry["last_used"] = time.monotonic()
+                    return
+
+        # connection was never pooled (pool full or already discarded) - close it
+        self._disconnect(conn)
+
+    def discard(self, conn):
+        """
+        Close a connection and remove it from the pool. Use when the connection
+        state is unknown, e.g. after an error or after rebooting the device.
+
+        :param conn: connection previously returned by acquire()
+        :type conn: netmiko.ConnectHandler
+        """
+        with self._lock:
+            for key, entry in list(self._pool.items()):
+                if entry["conn"] is conn:
+                    self._close(key)
+                    return
+
+        self._disconnect(conn)
+
+    def close_all(self):
+        """
+        Close every pooled connection. Intended for shutdown.
+        """
+        with self._lock:
+            for key in list(self._pool):
+                self._close(key)
+
+    def _evict_stale(self):
+        """
+        Close idle and aged-out connections. Caller must hold the lock.
+        """
+        now = time.monotonic()
+
+        for key, entry in list(self._pool.items()):
+            if entry["in_use"]:
+                continue
+            if now - entry["last_used"] > self.idle_timeout or now - entry["created"] > self.max_age:
+                self._logger.debug("%s - Evicting stale pooled connection", key[0])
+                self._close(key)
+
+    def _close(self, key):
+        """
+        Remove a pool entry and close its connection. Caller must hold the lock.
+        """
+        entry = self._pool.pop(key)
+        self._disconnect(entry["conn"])
+
+    @staticmethod
+    def _disconnect(conn):
+        try:
+            conn.disconnect()
+        except Exception:
+            # connection may already be gone (device rebooted, timeout, etc.)
+            pass
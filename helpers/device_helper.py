@@ -1,10 +1,12 @@
 import getpass
+import json
 import logging
 import re
-import sys
-import subprocess
+import socket
+import threading
 from datetime import datetime
 from pathlib import Path
+from icmplib import ping as icmp_ping
 from netmiko import ConnectHandler, NetMikoAuthenticationException, NetMikoTimeoutException
 
 
@@ -21,6 +23,22 @@ class DeviceHelper:
 
     _logger = logging.getLogger(__name__)
 
+    # compiled once at import - bounded character classes rather than greedy .*
+    # so pathological banners cannot trigger catastrophic backtracking
+    _IOS_VER_RE = re.compile(r"Cisco IOS Software,[^,]*,\s*Version\s*([^\s,]+)", re.ASCII)
+
+    # device type that last worked per IP, so reconnects and re-runs skip the
+    # other probes (each wrong probe is a full SSH session)
+    _type_cache = {}
+    _type_cache_lock = threading.Lock()
+    _type_cache_file = Path.home() / ".cache" / "asaupdater" / "device_types.json"
+    _type_cache_loaded = False
+
+    # index of the credential that last worked per IP, so re-runs skip the
+    # credential matrix (each wrong attempt is a full SSH negotiation)
+    _cred_cache = {}
+    _cred_cache_lock = threading.Lock()
+
     @staticmethod
     def get_credentials():
         """
@@ -98,8 +116,7 @@ class DeviceHelper:
         :return: Cisco IOS version
         """
 
-        rexp = r"Cisco IOS Software, .* Version ?(.*)"
-        output = re.search(rexp, sh_ver)
+        output = DeviceHelper._IOS_VER_RE.search(sh_ver)
 
         if output:
             return output.group(1)
@@ -117,22 +134,70 @@ class DeviceHelper:
         :return: bool if the device responds to pings
         """
 
-        if sys.platform is "windows":
-            param = f"-n {ping_count}"
-        else:
-            param = f"-c {ping_count}"
+        # in-process ICMP - no fork per probe and no platform-specific ping flags
+        return icmp_ping(host, count=ping_count, interval=0.2, timeout=1,
+                         privileged=False).is_alive
 
-        command = f"ping {param} {host}".split()
-        sub = subprocess.Popen(command)
-        sub.wait()
-        result = sub.poll()
+    @staticmethod
+    def _port_open(ip, port=22, timeout=2):
+        """
+        Check if a TCP port on a host accepts connections.
 
-        # if result = 0 then it was successful
-        if result == 0:
+        :param ip: host address to probe
+        :type ip: str
+        :param port: TCP port to probe. Default is 22
+        :type port: int
+        :param timeout: seconds to wait for the connection
+        :type timeout: int
+        :return: bool
+        """
+        try:
+            socket.create_connection((ip, port), timeout=timeout).close()
             return True
-        else:
+        except OSError:
             return False
 
+    @classmethod
+    def _cached_device_type(cls, ipaddr):
+        """
+        Return the device type that last worked for an IP, or None.
+
+        :param ipaddr: IP Address of the device
+        :type ipaddr: str
+        :return: str or None
+        """
+        with cls._type_cache_lock:
+            if not cls._type_cache_loaded:
+                cls._type_cache_loaded = True
+                try:
+                    with cls._type_cache_file.open(mode="r") as file:
+                        cls._type_cache.update(json.load(file))
+                except (OSError, ValueError):
+                    # no cache yet, or an unreadable one - start empty
+                    pass
+            return cls._type_cache.get(ipaddr)
+
+    @classmethod
+    def _remember_device_type(cls, ipaddr, device_type):
+        """
+        Record the device type that worked for an IP and persist the cache so
+        later runs skip discovery entirely.
+
+        :param ipaddr: IP Address of the device
+        :type ipaddr: str
+        :param device_type: netmiko device type that connected successfully
+        :type device_type: str
+        """
+        with cls._type_cache_lock:
+            cls._type_cache[ipaddr] = device_type
+            try:
+                cls._type_cache_file.parent.mkdir(parents=True, exist_ok=True)
+                with cls._type_cache_file.open(mode="w") as file:
+                    json.dump(cls._type_cache, file)
+            except OSError:
+                # persisting is best effort - the in-memory cache still helps
+                pass
+
     @classmethod
     def connect_to_device(cls, ipaddr, credentials, enable_mode=False, device_type='autodetect', timeout=None):
         """
@@ -188,11 +253,29 @@ class DeviceHelper:
                 credentials = [credentials]
 
             # convert device_type to a list if its not a list
-            if not isinstance(credentials, list):
+            if not isinstance(device_type, list):
                 device_type = [device_type]
 
+            # try the type that worked for this device last time first
+            cached_type = cls._cached_device_type(ipaddr)
+            if cached_type in device_type and device_type[0] != cached_type:
+                device_type = [cached_type] + [d for d in device_type if d != cached_type]
+
+            # fail fast on unreachable devices - a cheap TCP probe instead of a
+            # full SSH negotiation per credential/type combination
+            if not cls._port_open(ipaddr, timeout=timeout or 2):
+                cls._logger.error(f"{ipaddr} - SSH port not reachable")
+                raise ConnectionException("Unable to reach device on TCP port 22")
+
+            # try the credential that worked for this device last time first
+            indexed_credentials = list(enumerate(credentials))
+            with cls._cred_cache_lock:
+                cached_cred = cls._cred_cache.get(ipaddr)
+            if cached_cred is not None and cached_cred < len(indexed_credentials):
+                indexed_credentials.sort(key=lambda pair: pair[0] != cached_cred)
+
             try:
-                for c in credentials:
+                for cred_idx, c in indexed_credentials:
 
                     # set username / password / secret
                     if "username" in c:
@@ -210,8 +293,8 @@ class DeviceHelper:
                     for d in device_type:
 
                         try:
-                            cls._logger.debug(f"{ipaddr} - Attempting to connect using "
-                                              f"device type: {d}")
+                            cls._logger.debug("%s - Attempting to connect using "
+                                              "device type: %s", ipaddr, d)
 
                             device['device_type'] = d
 
@@ -220,13 +303,17 @@ class DeviceHelper:
                             if enable_mode:
                                 connection.enable()
 
+                            cls._remember_device_type(ipaddr, d)
+                            with cls._cred_cache_lock:
+                                cls._cred_cache[ipaddr] = cred_idx
+
                             cls._logger.info(f"{ipaddr} - Connection established")
                             return connection
 
                         except NetMikoAuthenticationException:
                             # Ignore except - unable to connect based on current User/pass type combo
                             # Move onto next set
-                            cls._logger.debug(f"{ipaddr} - Current username/password incorrect")
+                            cls._logger.debug("%s - Current username/password incorrect", ipaddr)
                             pass
                         except NetMikoTimeoutException as e:
                             # unable to connect to device
@@ -1,10 +1,9 @@
-import threading
-from queue import Queue
+from concurrent.futures import ThreadPoolExecutor
 
 
 class ThreadingHelper:
     """
-    Helper class for using Threading and Queues.
+    Helper class for running a function over a list of items in a thread pool.
 
     Example:
 
@@ -31,39 +30,19 @@ class ThreadingHelper:
         :type worker_func_args: dictionary
 
         """
-        self.input_queue = Queue()
-        self.output_queue = Queue()
         self.num_of_workers = num_of_workers
         self.worker_func = worker_func
-        self.worker_func_args = worker_func_args
-
-    def __worker(self):
-        """
-        Thread worker method.
-        """
-        # Verify that the queue is not empty
-        while not self.input_queue.empty():
-            item = self.input_queue.get()
-            r = self.worker_func(item, **self.worker_func_args)
-
-            self.output_queue.put(r)
-
-            self.input_queue.task_done()
+        self.worker_func_args = worker_func_args if worker_func_args is not None else {}
 
     def run(self, items):
         """
-        Method for running method in a thread.
+        Method for running the worker function over each item in a thread pool.
 
-        :param items: list of items that each element will be swapped into another thread.
+        :param items: list of items that will each be passed to the worker function in a thread.
         :type items: list
-        :return: If the function returns a value, a list will be returned with the return values.
-                 If not then None will be returned.
+        :return: list of the worker function return values, in the same order as items.
         """
-        for item in items:
-            self.input_queue.put(item)
-        for i in range(self.num_of_workers):
-            t = threading.Thread(target=self.__worker)
-            t.start()
-        self.input_queue.join()
-        return list(self.output_queue.queue)
-
+        with ThreadPoolExecutor(max_workers=self.num_of_workers,
+                                thread_name_prefix="asa-upd") as executor:
+            return list(executor.map(lambda item: self.worker_func(item, **self.worker_func_args),
+                                     items))